@@ -3,16 +3,43 @@ import random
 import time
 import json
 import websockets
+from websockets.exceptions import ConnectionClosed
 import webbrowser
 import os
 import csv
 import logging
+import heapq
 from collections import deque
-from statistics import mean
+
+# orjson (C extension) is optional; fall back to the stdlib encoder without it
+try:
+    import orjson
+
+    def json_dumps(obj):
+        # Decode so frames stay text: the dashboard JSON.parse()s evt.data
+        return orjson.dumps(obj).decode()
+
+    json_loads = orjson.loads
+except ImportError:
+    def json_dumps(obj):
+        return json.dumps(obj, separators=(",", ":"))
+
+    json_loads = json.loads
+
+# numpy is optional too; it only speeds up random number generation
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # --- CONFIGURATION ---
 NODES_COUNT = 4
 DEFAULT_POLICY = "work_stealing"
+ASSIGN_BATCH = 32         # Max tasks dispatched per assign_loop pass
+CSV_FLUSH_INTERVAL = 2.0  # Seconds between flushes of the recording file
+RNG_POOL = 4096           # Random samples generated per batch by the workload
+CLIENT_QUEUE_SIZE = 4     # Frames buffered per dashboard client before dropping the oldest
+LAT_WINDOW = 50           # Recent completions used for dashboard latency stats
 
 # --- LOGGING SETUP ---
 logging.basicConfig(
@@ -28,6 +55,7 @@ class SimState:
         self.recording = False
         self.csv_file = None
         self.csv_writer = None
+        self.last_flush = 0.0
         self.scenario_active = False
 
 sim_state = SimState()
@@ -37,13 +65,18 @@ sim_state = SimState()
 # ============================================================================
 
 class Task:
+    __slots__ = ("tid", "work_units", "created_at", "completed_at")
+
     def __init__(self, tid, work_units):
         self.tid = tid
         self.work_units = work_units
-        self.created_at = time.time()
+        self.created_at = time.perf_counter_ns()
         self.completed_at = None
 
 class Node:
+    __slots__ = ("nid", "scheduler", "speed", "queue", "busy", "active", "completed",
+                 "_next_ready", "_has_work", "_alive")
+
     def __init__(self, nid, scheduler, speed=1.0):
         self.nid = nid
         self.scheduler = scheduler
@@ -52,28 +85,41 @@ class Node:
         self.busy = False
         self.active = True
         self.completed = 0
+        self._next_ready = 0.0  # Loop time at which the current task finishes; 0 when idle
+        self._has_work = asyncio.Event()
+        self._alive = asyncio.Event()
+        self._alive.set()
 
     async def run(self):
+        loop = asyncio.get_running_loop()
         while True:
             # Check lifecyle
             if not self.active:
-                await asyncio.sleep(0.5)
+                self._next_ready = 0.0
+                await self._alive.wait()
                 continue
             
             # Check for work
             if not self.queue:
-                await asyncio.sleep(0.05)
+                self._next_ready = 0.0
+                self._has_work.clear()
+                await self._has_work.wait()
                 continue
             
             # Process Task
             task = self.queue.popleft()
+            self.scheduler.note_load(self)
             self.busy = True
             
-            # Simulate CPU work (Software Delay)
-            await asyncio.sleep(task.work_units / self.speed)
+            # Simulate CPU work (Software Delay). A task taken straight after the
+            # previous one starts at that task's deadline rather than at the
+            # (later) wakeup time, so sleep overshoot does not pile up
+            now = loop.time()
+            self._next_ready = (self._next_ready or now) + task.work_units / self.speed
+            await asyncio.sleep(max(0.0, self._next_ready - now))
             
             # Complete Task
-            task.completed_at = time.time()
+            task.completed_at = time.perf_counter_ns()
             self.completed += 1
             self.busy = False
             self.scheduler.report_completion(task)
@@ -81,13 +127,17 @@ class Node:
     def push(self, task):
         if self.active:
             self.queue.append(task)
+            self._has_work.set()
+            self.scheduler.note_load(self)
 
     def steal_tasks(self, amount=1):
-        stolen = []
         if not self.active: return []
-        # Steal from the back (tasks not yet started)
-        for _ in range(min(amount, max(0, len(self.queue) - 1))):
-            stolen.append(self.queue.pop())
+        # Steal from the back (tasks not yet started), always leaving one behind
+        count = min(amount, len(self.queue) - 1)
+        if count <= 0: return []
+        pop = self.queue.pop
+        stolen = [pop() for _ in range(count)]
+        self.scheduler.note_load(self)
         return stolen
 
     def queue_len(self):
@@ -95,12 +145,62 @@ class Node:
 
 class Scheduler:
     def __init__(self, num_nodes=4, policy="least_loaded"):
+        # Work-stealing bookkeeping, maintained through note_load():
+        # a lazy max-heap of (-queue_len, nid) and the set of idle active nodes
+        self._by_load = []
+        self._idle = set(range(num_nodes))
+        # Set when stealing could help: a node ran dry, or a queue grew past
+        # one task while some node sits idle
+        self._steal_needed = asyncio.Event()
+        # Set only while the policy is work_stealing (see the policy setter)
+        self._ws_policy_evt = asyncio.Event()
         self.policy = policy
+        self._rr_index = 0
         # Simulate slight hardware variance (Node 0 is 20% faster)
         self.nodes = [Node(i, self, speed=1.0 + (0.2 if i==0 else 0)) for i in range(num_nodes)]
+        # Rebuilt only when a node is killed or revived
+        self._active_nodes = list(self.nodes)
         self.task_queue = asyncio.Queue()
         self.migrations = 0
-        self.latencies = []
+        # The last LAT_WINDOW latencies and their running sum, kept up to date
+        # on every completion so snapshot() never has to re-add them
+        self.lat_window = deque(maxlen=LAT_WINDOW)
+        self.lat_sum = 0 # Latencies are integer nanoseconds until reported
+        self.lat_count = 0
+        self._lat_cache = (-1, 0)
+        # Reused by snapshot() every tick; callers must encode it before the next call
+        self._snap = {
+            "timestamp": 0.0,
+            "policy": policy,
+            "queue_lengths": [0] * num_nodes,
+            "node_status": [True] * num_nodes,
+            "completed": [0] * num_nodes, # Required for new UI
+            "migrations": 0,
+            "avg_latency": 0,
+            "p95_latency": 0,
+            "utilization": 0,
+            "recording": False,
+            "scenario_active": False
+        }
+
+    @property
+    def policy(self):
+        return self._policy
+
+    @policy.setter
+    def policy(self, value):
+        # Resolve the dispatch strategy once here rather than per task
+        self._policy = value
+        self._dispatch = {
+            "round_robin": self._dispatch_round_robin,
+            "least_loaded": self._dispatch_least_loaded,
+            "work_stealing": self._dispatch_least_loaded,
+        }.get(value, self._dispatch_first)
+        if value == "work_stealing":
+            self._ws_policy_evt.set()
+            self._steal_needed.set() # Rebalance whatever the old policy left behind
+        else:
+            self._ws_policy_evt.clear()
 
     async def start(self):
         for n in self.nodes:
@@ -108,39 +208,57 @@ class Scheduler:
         asyncio.create_task(self.assign_loop())
         asyncio.create_task(self.work_stealing_loop())
 
-    async def assign_task(self, task):
-        await self.task_queue.put(task)
+    def assign_task(self, task):
+        # The queue is unbounded, so put_nowait() never fails
+        self.task_queue.put_nowait(task)
 
     async def assign_loop(self):
-        rr_index = 0
         while True:
-            task = await self.task_queue.get()
-            
-            active_nodes = [n for n in self.nodes if n.active]
+            # Wait for one task, then drain whatever else is already queued
+            batch = [await self.task_queue.get()]
+            try:
+                while len(batch) < ASSIGN_BATCH:
+                    batch.append(self.task_queue.get_nowait())
+            except asyncio.QueueEmpty:
+                pass
+
+            active_nodes = self._active_nodes
             if not active_nodes:
                 await asyncio.sleep(1)
-                await self.task_queue.put(task)
+                for task in batch: self.task_queue.put_nowait(task)
                 continue
 
-            target = active_nodes[0]
-            if self.policy == "round_robin":
-                target = active_nodes[rr_index % len(active_nodes)]
-                rr_index += 1
-            elif self.policy in ("least_loaded", "work_stealing"):
-                target = min(active_nodes, key=lambda n: n.queue_len())
+            self._dispatch(active_nodes, batch)
+
+    def _dispatch_round_robin(self, active_nodes, batch):
+        for task in batch:
+            active_nodes[self._rr_index % len(active_nodes)].push(task)
+            self._rr_index += 1
 
+    def _dispatch_least_loaded(self, active_nodes, batch):
+        # Heap of (queue length, index, node): O(log n) per task
+        heap = [(n.queue_len(), i, n) for i, n in enumerate(active_nodes)]
+        heapq.heapify(heap)
+        for task in batch:
+            qlen, i, target = heap[0]
             target.push(task)
+            heapq.heapreplace(heap, (qlen + 1, i, target))
+
+    def _dispatch_first(self, active_nodes, batch):
+        for task in batch: active_nodes[0].push(task)
 
     async def work_stealing_loop(self):
         while True:
-            await asyncio.sleep(0.25)
+            # Park entirely while another policy is active
+            await self._ws_policy_evt.wait()
+            await self._steal_needed.wait()
+            self._steal_needed.clear()
             if self.policy != "work_stealing": continue
 
-            active_nodes = [n for n in self.nodes if n.active]
-            idle_nodes = [n for n in active_nodes if n.queue_len() == 0]
-            busiest = max(active_nodes, key=lambda n: n.queue_len()) if active_nodes else None
+            busiest = self._busiest()
             
-            if idle_nodes and busiest and busiest.queue_len() > 1:
+            if self._idle and busiest and busiest.queue_len() > 1:
+                idle_nodes = [self.nodes[nid] for nid in self._idle]
                 amount = max(1, busiest.queue_len() // 4)
                 stolen = busiest.steal_tasks(amount)
                 if stolen:
@@ -148,52 +266,118 @@ class Scheduler:
                         idle_nodes[i % len(idle_nodes)].push(task)
                     self.migrations += len(stolen)
 
+    def note_load(self, node):
+        # Called by a node whenever its queue length changes
+        qlen = len(node.queue)
+        if node.active and qlen == 0:
+            self._idle.add(node.nid)
+            self._steal_needed.set()
+        else:
+            self._idle.discard(node.nid)
+            if qlen > 1 and self._idle: self._steal_needed.set()
+        if node.active and qlen:
+            heapq.heappush(self._by_load, (-qlen, node.nid))
+            # Stale entries are only dropped while stealing; compact if they pile up
+            if len(self._by_load) > 8 * len(self.nodes):
+                self._by_load = [(-n.queue_len(), n.nid) for n in self.nodes if n.active and n.queue]
+                heapq.heapify(self._by_load)
+
+    def _busiest(self):
+        # Pop stale entries until the top matches a live node's queue length
+        while self._by_load:
+            neg_len, nid = self._by_load[0]
+            node = self.nodes[nid]
+            if node.active and -neg_len == len(node.queue):
+                return node
+            heapq.heappop(self._by_load)
+        return None
+
     def report_completion(self, task):
-        if task.completed_at and task.created_at:
-            self.latencies.append(task.completed_at - task.created_at)
-            # Keep memory usage low
-            if len(self.latencies) > 5000:
-                self.latencies = self.latencies[-2000:]
+        if task.completed_at is not None:
+            lat = task.completed_at - task.created_at
+            # Slide the window: forget the sample that is about to fall out of it
+            if len(self.lat_window) == LAT_WINDOW:
+                self.lat_sum -= self.lat_window[0]
+            self.lat_window.append(lat)
+            self.lat_sum += lat
+            self.lat_count += 1
+
+    def _p95(self, count):
+        # Reuse the last result until another completion arrives
+        if self._lat_cache[0] == self.lat_count:
+            return self._lat_cache[1]
+        p95 = 0
+        if count:
+            # Nearest-rank p95 is the ceil(0.95 * n)-th smallest sample, i.e. the
+            # (floor(n / 20) + 1)-th largest. Integer math, so no float rounding;
+            # nlargest() keeps only that many samples instead of sorting them all
+            tail = count // 20 + 1
+            p95 = heapq.nlargest(tail, self.lat_window)[-1]
+        self._lat_cache = (self.lat_count, p95)
+        return p95
+
+    def _refresh_active(self):
+        self._active_nodes = [n for n in self.nodes if n.active]
 
     def kill_node(self, nid):
         if 0 <= nid < len(self.nodes):
             self.nodes[nid].active = False
+            self.nodes[nid]._alive.clear()
+            self._refresh_active()
             dead_tasks = list(self.nodes[nid].queue)
             self.nodes[nid].queue.clear()
-            for t in dead_tasks: asyncio.create_task(self.task_queue.put(t))
+            self.note_load(self.nodes[nid])
+            for t in dead_tasks: self.task_queue.put_nowait(t)
 
     def revive_node(self, nid):
         if 0 <= nid < len(self.nodes):
             self.nodes[nid].active = True
+            self.nodes[nid]._alive.set()
+            self._refresh_active()
+            self.note_load(self.nodes[nid])
 
     def snapshot(self):
         # Calculate Statistics for the Dashboard
-        recent_lats = self.latencies[-50:] if self.latencies else [0]
-        avg_lat = mean(recent_lats) if recent_lats else 0
-        p95 = sorted(recent_lats)[int(len(recent_lats) * 0.95)] if recent_lats else 0
-        
-        active_count = sum(1 for n in self.nodes if n.active)
-        busy_count = sum(1 for n in self.nodes if n.active and n.busy)
+        count = len(self.lat_window)
+        avg_lat = self.lat_sum / count / 1e9 if count else 0
+        p95 = self._p95(count) / 1e9
+
+        # One pass over the nodes fills the per-node lists and the utilization counts
+        snap = self._snap
+        ql, ns, cp = snap["queue_lengths"], snap["node_status"], snap["completed"]
+        active_count = busy_count = 0
+        for i, n in enumerate(self.nodes):
+            ql[i] = len(n.queue)
+            ns[i] = n.active
+            cp[i] = n.completed
+            if n.active:
+                active_count += 1
+                if n.busy: busy_count += 1
         utilization = (busy_count / active_count * 100) if active_count > 0 else 0
 
-        return {
-            "timestamp": time.time(),
-            "policy": self.policy,
-            "queue_lengths": [n.queue_len() for n in self.nodes],
-            "node_status": [n.active for n in self.nodes],
-            "completed": [n.completed for n in self.nodes], # Required for new UI
-            "migrations": self.migrations,
-            "avg_latency": round(avg_lat, 3),
-            "p95_latency": round(p95, 3),
-            "utilization": round(utilization, 1),
-            "recording": sim_state.recording,
-            "scenario_active": sim_state.scenario_active
-        }
+        snap["timestamp"] = time.time()
+        snap["policy"] = self.policy
+        snap["migrations"] = self.migrations
+        snap["avg_latency"] = round(avg_lat, 3)
+        snap["p95_latency"] = round(p95, 3)
+        snap["utilization"] = round(utilization, 1)
+        snap["recording"] = sim_state.recording
+        snap["scenario_active"] = sim_state.scenario_active
+        return snap
 
 # ============================================================================
 # PART 2: WORKLOAD GENERATOR
 # ============================================================================
 
+def random_stream(low, high):
+    # Endless uniform samples, generated RNG_POOL at a time instead of one per call
+    rng = np.random.default_rng() if np is not None else None
+    while True:
+        if rng is not None:
+            yield from rng.uniform(low, high, RNG_POOL).tolist()
+        else:
+            yield from [random.uniform(low, high) for _ in range(RNG_POOL)]
+
 class WorkloadGenerator:
     def __init__(self, scheduler):
         self.scheduler = scheduler
@@ -201,10 +385,14 @@ class WorkloadGenerator:
         self.manual_burst = False
         self.rate_low = 0.3
         self.rate_high = 0.8
+        self._work = random_stream(0.3, 0.9)
+        self._sleep = random_stream(self.rate_low, self.rate_high)
+        self._chance = random_stream(0.0, 1.0)
 
     def set_rate(self, low, high):
         self.rate_low = low
         self.rate_high = high
+        self._sleep = random_stream(low, high)
         logger.info(f"Workload Rate Updated: {low}s - {high}s")
 
     def trigger_burst(self):
@@ -215,23 +403,22 @@ class WorkloadGenerator:
         while True:
             if self.manual_burst:
                 logger.info(">>> BURST TRIGGERED <<<")
-                for _ in range(15): await self.create_task()
+                for _ in range(15): self.create_task()
                 self.manual_burst = False
                 await asyncio.sleep(1)
                 continue
 
             # Random Traffic
-            if random.random() < 0.05:
-                for _ in range(5): await self.create_task()
+            if next(self._chance) < 0.05:
+                for _ in range(5): self.create_task()
             else:
-                await self.create_task()
+                self.create_task()
             
             # Dynamic sleep based on UI settings
-            await asyncio.sleep(random.uniform(self.rate_low, self.rate_high))
+            await asyncio.sleep(next(self._sleep))
 
-    async def create_task(self):
-        work = random.uniform(0.3, 0.9)
-        await self.scheduler.assign_task(Task(self.tid, work))
+    def create_task(self):
+        self.scheduler.assign_task(Task(self.tid, next(self._work)))
         self.tid += 1
 
 # ============================================================================
@@ -242,9 +429,10 @@ def toggle_recording():
     if not sim_state.recording:
         os.makedirs("data_logs", exist_ok=True)
         filename = os.path.join("data_logs", f"run_{int(time.time())}.csv")
-        sim_state.csv_file = open(filename, "w", newline="")
+        sim_state.csv_file = open(filename, "w", newline="", buffering=65536)
         sim_state.csv_writer = csv.writer(sim_state.csv_file)
         sim_state.csv_writer.writerow(["timestamp", "policy", "migrations", "utilization", "p95_latency"])
+        sim_state.last_flush = time.monotonic()
         sim_state.recording = True
         logger.info(f"Recording to: {filename}")
         return True
@@ -284,13 +472,23 @@ async def run_scenario_logic(scheduler, workload):
 # PART 4: WEBSOCKET SERVER
 # ============================================================================
 
-clients = set()
+clients = {} # websocket -> outbox queue drained by client_writer()
+
+async def client_writer(ws, outbox):
+    # One writer per client, so a slow socket only ever delays itself
+    try:
+        while True:
+            await ws.send(await outbox.get())
+    except ConnectionClosed: pass
+    finally: clients.pop(ws, None) # However the writer ends, stop queueing frames for it
 
 async def ws_handler(ws):
-    clients.add(ws)
+    outbox = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+    clients[ws] = outbox
+    writer = asyncio.create_task(client_writer(ws, outbox))
     try:
         async for message in ws:
-            data = json.loads(message)
+            data = json_loads(message)
             cmd = data.get("cmd")
             
             if cmd == "burst": global_workload.trigger_burst()
@@ -308,24 +506,36 @@ async def ws_handler(ws):
                 high = float(data.get("high", 0.8))
                 global_workload.set_rate(low, high)
             
-    except: pass
-    finally: clients.remove(ws)
+    except ConnectionClosed: pass
+    finally:
+        writer.cancel()
+        clients.pop(ws, None)
 
 async def broadcaster(scheduler):
+    last_key = msg = None
     while True:
         snap = scheduler.snapshot()
-        msg = json.dumps(snap)
         
         if clients:
-            dead = set()
-            for c in clients:
-                try: await c.send(msg)
-                except: dead.add(c)
-            for c in dead: clients.remove(c)
+            # The dashboard plots one point per frame, so a frame goes out every
+            # tick; it is only re-encoded when more than the timestamp changed
+            key = (snap["policy"], snap["migrations"], snap["avg_latency"], snap["p95_latency"],
+                   snap["utilization"], snap["recording"], snap["scenario_active"],
+                   *snap["queue_lengths"], *snap["node_status"], *snap["completed"])
+            if key != last_key:
+                last_key = key
+                msg = json_dumps(snap)
+            # Hand the frame to each client's writer; never await a socket here
+            for outbox in clients.values():
+                if outbox.full(): outbox.get_nowait() # Slow client: drop its stalest frame
+                outbox.put_nowait(msg)
         
         if sim_state.recording and sim_state.csv_writer:
             sim_state.csv_writer.writerow([snap["timestamp"], snap["policy"], snap["migrations"], snap["utilization"], snap["p95_latency"]])
-            sim_state.csv_file.flush()
+            # Rows collect in the file buffer; only hit the OS every few seconds
+            if time.monotonic() - sim_state.last_flush >= CSV_FLUSH_INTERVAL:
+                sim_state.csv_file.flush()
+                sim_state.last_flush = time.monotonic()
             
         await asyncio.sleep(0.15) # 150ms update rate for smooth visuals
 